@@ -2,11 +2,228 @@
 # Итоговый практикум №2
 # Симулятор магазина с корзиной покупок с использованием алгоритмов сортировки
 
+import cProfile
+import functools
+import heapq
+import io
 import json
+import os
+import pstats
+import random
+import struct
+import sys
+import tempfile
 import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from copy import deepcopy
-from typing import List, Dict, Optional, Callable
+from itertools import islice
+from typing import List, Dict, Optional, Callable, Tuple
+
+# класс таймера операции для реестра метрик
+class _OperationTimer:
+
+    def __init__(self, registry: 'MetricsRegistry', name: str):
+        self.registry = registry
+        self.name = name
+        self.profiled = False
+
+    def __enter__(self):
+        self.profiled = self.registry._start_profile()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.profiled:
+            self.registry._stop_profile()
+        self.registry.observe(self.name, elapsed)
+        if exc_type is not None:
+            self.registry.inc(self.name + '.errors')
+        return False
+
+# пустой таймер, когда метрики выключены
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+# класс реестра метрик: счетчики, гистограммы задержек по операциям, выборочное профилирование
+class MetricsRegistry:
+
+    # границы корзин гистограммы задержек, секунды
+    BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+    _NULL_TIMER = _NullTimer()
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters = {}              # имя - значение
+        self.histograms = {}            # имя - [кол-во по корзинам..., +Inf, сумма, мин, макс]
+        self.profile_rate = 0.0         # доля операций, выполняемых под cProfile
+        self._profiler = None
+        self._profiling_now = False
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    # сброс всех собранных значений
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+        if self._profiler is not None:
+            self._profiler = cProfile.Profile()
+
+    # увеличение счетчика
+    def inc(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # учет длительности операции в гистограмме
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = [0] * (len(self.BUCKETS) + 1) + [0.0, seconds, seconds]
+        idx = 0
+        while idx < len(self.BUCKETS) and seconds > self.BUCKETS[idx]:
+            idx += 1
+        hist[idx] += 1
+        hist[-3] += seconds
+        if seconds < hist[-2]:
+            hist[-2] = seconds
+        if seconds > hist[-1]:
+            hist[-1] = seconds
+
+    # таймер операции: with METRICS.timer('имя'): ...
+    def timer(self, name: str):
+        if not self.enabled:
+            return self._NULL_TIMER
+        return _OperationTimer(self, name)
+
+    # декоратор замера метода; при выключенных метриках - одна проверка флага
+    def timed(self, name: str):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _OperationTimer(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # включение выборочного профилирования: rate - доля замеряемых операций под cProfile
+    def enable_profiling(self, rate: float = 0.01):
+        if rate <= 0 or rate > 1:
+            raise ValueError("Доля профилирования должна быть в диапазоне (0, 1]")
+        self.profile_rate = rate
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+
+    # выключение профилирования (собранная статистика сохраняется до reset)
+    def disable_profiling(self):
+        self.profile_rate = 0.0
+
+    def _start_profile(self) -> bool:
+        if not self.profile_rate or self._profiling_now or random.random() >= self.profile_rate:
+            return False
+        self._profiling_now = True
+        self._profiler.enable()
+        return True
+
+    def _stop_profile(self):
+        self._profiler.disable()
+        self._profiling_now = False
+
+    # отчет профилировщика: самые затратные функции
+    def profile_report(self, limit: int = 20) -> str:
+        if self._profiler is None:
+            return "Профилирование не включалось."
+        stream = io.StringIO()
+        try:
+            stats = pstats.Stats(self._profiler, stream=stream)
+        except TypeError:
+            return "Нет данных профилирования."
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    # текстовый отчет
+    def report(self) -> str:
+        lines = ["============== МЕТРИКИ ОПЕРАЦИЙ =============="]
+        if not self.histograms and not self.counters:
+            lines.append("Нет данных." if self.enabled else "Метрики выключены, данных нет.")
+        for name in sorted(self.histograms):
+            hist = self.histograms[name]
+            count = sum(hist[:-3])
+            lines.append(f"{name}: {count} вызовов, сред. {hist[-3] / count * 1000:.3f} мс, "
+                         f"мин. {hist[-2] * 1000:.3f} мс, макс. {hist[-1] * 1000:.3f} мс, "
+                         f"p50 <= {self._quantile(hist, 0.5)}, p99 <= {self._quantile(hist, 0.99)}")
+        for name in sorted(self.counters):
+            lines.append(f"{name}: {self.counters[name]}")
+        lines.append("==============================================")
+        return "\n".join(lines)
+
+    # верхняя граница корзины, в которую попадает квантиль
+    def _quantile(self, hist: List, q: float) -> str:
+        target = q * sum(hist[:-3])
+        seen = 0
+        for idx, bound in enumerate(self.BUCKETS):
+            seen += hist[idx]
+            if seen >= target:
+                return f"{bound * 1000:g} мс"
+        return "+Inf"
+
+    # экспорт в текстовом формате Prometheus
+    def export_prometheus(self, filename: str) -> bool:
+        lines = []
+        if self.histograms:
+            lines.append("# HELP shop_operation_seconds Длительность операций магазина")
+            lines.append("# TYPE shop_operation_seconds histogram")
+        for name in sorted(self.histograms):
+            hist = self.histograms[name]
+            cumulative = 0
+            for idx, bound in enumerate(self.BUCKETS):
+                cumulative += hist[idx]
+                lines.append(f'shop_operation_seconds_bucket{{operation="{name}",le="{bound:g}"}} {cumulative}')
+            cumulative += hist[len(self.BUCKETS)]
+            lines.append(f'shop_operation_seconds_bucket{{operation="{name}",le="+Inf"}} {cumulative}')
+            lines.append(f'shop_operation_seconds_sum{{operation="{name}"}} {hist[-3]:.9f}')
+            lines.append(f'shop_operation_seconds_count{{operation="{name}"}} {cumulative}')
+        if self.counters:
+            lines.append("# HELP shop_events_total Счетчики событий магазина")
+            lines.append("# TYPE shop_events_total counter")
+        for name in sorted(self.counters):
+            lines.append(f'shop_events_total{{name="{name}"}} {self.counters[name]}')
+
+        try:
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            return True
+        except Exception as e:
+            print(f"Ошибка при экспорте метрик: {e}")
+            return False
+
+# глобальный реестр метрик (по умолчанию выключен)
+METRICS = MetricsRegistry()
+
+# буферизованный вывод строк: одна запись в поток на каждые chunk_lines строк
+def write_lines(lines, out=None, chunk_lines: int = 1000):
+
+    out = sys.stdout if out is None else out
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_lines))
+        if not chunk:
+            break
+        out.write("\n".join(chunk) + "\n")
+    out.flush()
 
 # класс товаров
 class Product:
@@ -38,12 +255,143 @@ class Product:
             'description': self.description
         }
 
+    # словарь - товар
+    @staticmethod
+    def from_dict(data: Dict) -> 'Product':
+        return Product(
+            data['id'],
+            data['name'],
+            data['category'],
+            data['price'],
+            data['weight'],
+            data.get('description', '')
+        )
+
+# класс события изменения каталога
+class CatalogEvent:
+
+    ADDED = 'added'                 # товар добавлен
+    REMOVED = 'removed'             # товар удален
+    CHANGED = 'changed'             # изменено поле товара
+    RELOADED = 'reloaded'           # каталог целиком заменен (загрузка из файла)
+
+    # событие: тип, ID товара, поле, старое и новое значение
+    def __init__(self, kind: str, product_id: Optional[int] = None, field: Optional[str] = None,
+                 old_value=None, new_value=None):
+
+        self.kind = kind
+        self.product_id = product_id
+        self.field = field
+        self.old_value = old_value
+        self.new_value = new_value
+
+    # строка - событие
+    def __repr__(self):
+        if self.kind == CatalogEvent.CHANGED:
+            return f"CatalogEvent({self.kind}, id={self.product_id}, {self.field}: {self.old_value!r} -> {self.new_value!r})"
+        return f"CatalogEvent({self.kind}, id={self.product_id})"
+
 # класс для управления каталогом товаров
 class ProductCatalog:
 
     def __init__(self):                 # каталога товаров
         self.products = []
+        self.index = {}                 # индекс товаров по ID (при повторе ID - первый в списке)
+        self._duplicate_ids = set()     # ID, встречающиеся в каталоге несколько раз (после загрузки файла)
         self.next_id = 1
+        self._subscribers = []          # подписчики на события каталога
+        self._batch_depth = 0           # глубина вложенности пакетной группировки
+        self._pending = []              # накопленные события внутри пакета
+
+    # подписка на события каталога: callback получает список событий
+    def subscribe(self, callback: Callable[[List[CatalogEvent]], None]):
+
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    # отписка от событий каталога
+    def unsubscribe(self, callback: Callable[[List[CatalogEvent]], None]) -> bool:
+
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+            return True
+        return False
+
+    # пакетная группировка изменений: одно общее уведомление на выходе из блока
+    @contextmanager
+    def batch(self):
+
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._pending:
+                events = self._coalesce(self._pending)
+                self._pending = []
+                if events:
+                    self._notify(events)
+
+    # публикация события (без подписчиков - ничего не создается)
+    def _publish(self, kind: str, product_id: Optional[int] = None, field: Optional[str] = None,
+                 old_value=None, new_value=None):
+
+        if not self._subscribers:
+            return
+        METRICS.inc('catalog_events.' + kind)
+        event = CatalogEvent(kind, product_id, field, old_value, new_value)
+        if self._batch_depth:
+            self._pending.append(event)
+        else:
+            self._notify([event])
+
+    # рассылка событий подписчикам
+    def _notify(self, events: List[CatalogEvent]):
+
+        for callback in list(self._subscribers):
+            callback(events)
+
+    # схлопывание событий пакета: для поля товара остается первое старое и последнее новое значение
+    @staticmethod
+    def _coalesce(events: List[CatalogEvent]) -> List[CatalogEvent]:
+
+        # после полной замены каталога предыдущие события не имеют смысла
+        for idx in range(len(events) - 1, -1, -1):
+            if events[idx].kind == CatalogEvent.RELOADED:
+                events = events[idx:]
+                break
+
+        result = []                     # события по порядку; отброшенные заменяются на None
+        changes = {}                    # ID - {поле: позиция события изменения в result}
+        added = {}                      # ID - позиция события добавления в result
+        for event in events:
+            if event.kind == CatalogEvent.CHANGED:
+                if event.product_id in added:
+                    continue            # товар добавлен в этом же пакете, подписчик прочитает итоговые поля
+                fields = changes.get(event.product_id)
+                if fields is None:
+                    fields = changes[event.product_id] = {}
+                pos = fields.get(event.field)
+                if pos is not None:
+                    result[pos].new_value = event.new_value
+                else:
+                    fields[event.field] = len(result)
+                    result.append(CatalogEvent(event.kind, event.product_id, event.field,
+                                               event.old_value, event.new_value))
+            elif event.kind == CatalogEvent.REMOVED and event.product_id in added:
+                # добавлен и удален в одном пакете - подписчику сообщать нечего
+                result[added.pop(event.product_id)] = None
+            else:
+                if event.kind == CatalogEvent.ADDED:
+                    added[event.product_id] = len(result)
+                elif event.kind == CatalogEvent.REMOVED:
+                    for pos in changes.pop(event.product_id, {}).values():
+                        result[pos] = None
+                result.append(event)
+
+        # изменения, вернувшие поле к исходному значению, не публикуются
+        return [e for e in result
+                if e is not None and (e.kind != CatalogEvent.CHANGED or e.old_value != e.new_value)]
 
     # + новый товар: название, категория, цена, вес, описание, объект
     def add_product(self, name: str, category: str, price: float, weight: float, description: str = "") -> Product:
@@ -55,7 +403,9 @@ class ProductCatalog:
 
         product = Product(self.next_id, name, category, price, weight, description)
         self.products.append(product)
+        self.index[product.id] = product
         self.next_id += 1
+        self._publish(CatalogEvent.ADDED, product.id)
         return product
 
     # редактирование товара: ID, название, категория, цена, вес, описание
@@ -65,11 +415,26 @@ class ProductCatalog:
         if not product:
             return None
 
+        # проверка всех полей до изменений, чтобы товар не остался изменен наполовину
+        new_id = kwargs.get('id', product_id)
+        if new_id != product_id and new_id in self.index:
+            raise ValueError(f"Товар с ID {new_id} уже существует")
+        for key, value in kwargs.items():
+            if key in ['price', 'weight'] and hasattr(product, key) and value <= 0:
+                raise ValueError(f"{key.capitalize()} должен быть положительным числом")
+
         for key, value in kwargs.items():
             if hasattr(product, key):
-                if key in ['price', 'weight'] and value <= 0:
-                    raise ValueError(f"{key.capitalize()} должен быть положительным числом")
-                setattr(product, key, value)
+                old_value = getattr(product, key)
+                if old_value != value:
+                    if key == 'id':
+                        self._unindex(product)
+                    setattr(product, key, value)
+                    if key == 'id':
+                        self.index[value] = product
+                        if value >= self.next_id:
+                            self.next_id = value + 1
+                    self._publish(CatalogEvent.CHANGED, product_id, key, old_value, value)
 
         return product
 
@@ -78,17 +443,28 @@ class ProductCatalog:
 
         product = self.find_product_by_id(product_id)
         if product:
+            self._unindex(product)
             self.products.remove(product)
+            self._publish(CatalogEvent.REMOVED, product_id)
             return True
         return False
 
+    # удаление товара из индекса; при повторяющемся ID индекс переходит на следующий такой товар
+    def _unindex(self, product: Product):
+
+        if self.index.get(product.id) is product:
+            del self.index[product.id]
+        if product.id in self._duplicate_ids:
+            others = [other for other in self.products if other.id == product.id and other is not product]
+            if others:
+                self.index[product.id] = others[0]
+            if len(others) <= 1:
+                self._duplicate_ids.discard(product.id)
+
     # поиск товара по ID
     def find_product_by_id(self, product_id: int) -> Optional[Product]:
 
-        for product in self.products:
-            if product.id == product_id:
-                return product
-        return None
+        return self.index.get(product_id)
 
     # вывод списка товаров по категории
     def get_products_by_category(self, category: str) -> List[Product]:
@@ -96,6 +472,7 @@ class ProductCatalog:
         return [product for product in self.products if product.category.lower() == category.lower()]
 
     # сохранение каталога в файл
+    @METRICS.timed('save_to_file')
     def save_to_file(self, filename: str) -> bool:
 
         try:
@@ -107,42 +484,85 @@ class ProductCatalog:
             return False
 
     # загрузка каталога из файла
+    @METRICS.timed('load_from_file')
     def load_from_file(self, filename: str) -> bool:
 
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                self.products = []
-                max_id = 0
-                for item in data:
-                    product = Product(
-                        item['id'],
-                        item['name'],
-                        item['category'],
-                        item['price'],
-                        item['weight'],
-                        item.get('description', '')
-                    )
-                    self.products.append(product)
-                    if product.id > max_id:
-                        max_id = product.id
-                self.next_id = max_id + 1
+
+            # разбор в локальные структуры: при ошибке текущий каталог остается без изменений
+            products = []
+            index = {}
+            duplicate_ids = set()
+            max_id = 0
+            for item in data:
+                product = Product.from_dict(item)
+                products.append(product)
+                if product.id in index:
+                    duplicate_ids.add(product.id)       # как и раньше, поиск находит первый
+                else:
+                    index[product.id] = product
+                if product.id > max_id:
+                    max_id = product.id
+
+            self.products = products
+            self.index = index
+            self._duplicate_ids = duplicate_ids
+            self.next_id = max_id + 1
+            self._publish(CatalogEvent.RELOADED)
             return True
         except Exception as e:
             print(f"Ошибка при загрузке каталога: {e}")
             return False
 
-    # вывод всего каталога товаров
-    def display_catalog(self):
+    # товары каталога с фильтром по категории, начиная с offset, не более limit
+    def iter_products(self, offset: int = 0, limit: Optional[int] = None, category: Optional[str] = None):
+
+        if category is None:
+            # без фильтра страница берется срезом, стоимость O(размер страницы)
+            stop = None if limit is None else offset + limit
+            return iter(self.products[offset:stop])
+        category = category.lower()
+        matching = (product for product in self.products if product.category.lower() == category)
+        return islice(matching, offset, None if limit is None else offset + limit)
+
+    # строки каталога для вывода (генератор)
+    def iter_catalog_lines(self, offset: int = 0, limit: Optional[int] = None, category: Optional[str] = None):
+
+        for product in self.iter_products(offset, limit, category):
+            yield f"{product.id}. {product.name} - {product.price:.2f} руб. ({product.category})"
+
+    # вывод каталога товаров: страница page_size с позиции offset, фильтр по категории
+    # возвращает True, если после страницы есть еще товары
+    @METRICS.timed('display_catalog')
+    def display_catalog(self, page_size: Optional[int] = None, offset: int = 0,
+                        category: Optional[str] = None, out=None) -> bool:
 
         if not self.products:
-            print("Каталог товаров пуст.")
-            return
+            write_lines(["Каталог товаров пуст."], out)
+            return False
 
-        print("\n============== КАТАЛОГ ТОВАРОВ ==============")
-        for product in self.products:
-            print(f"{product.id}. {product.name} - {product.price:.2f} руб. ({product.category})")
-        print("==============================================")
+        limit = None if page_size is None else page_size + 1       # +1 товар - признак следующей страницы
+        lines = list(self.iter_catalog_lines(offset, limit, category)) if page_size is not None else None
+        has_more = page_size is not None and len(lines) > page_size
+
+        def render():
+            yield "\n============== КАТАЛОГ ТОВАРОВ =============="
+            shown = 0
+            source = self.iter_catalog_lines(offset, None, category) if lines is None else lines[:page_size]
+            for line in source:
+                shown += 1
+                yield line
+            if not shown:
+                yield "Товары не найдены."
+            elif page_size is not None:
+                yield (f"--- товары {offset + 1}-{offset + shown}" +
+                       (", есть следующая страница ---" if has_more else " ---"))
+            yield "=============================================="
+
+        write_lines(render(), out)
+        return has_more
 
 # класс управления товара в корзине
 class CartItem:
@@ -174,6 +594,9 @@ class CartItem:
 # класс управления корзиной покупок
 class ShoppingCart:
 
+    # заголовок снимка корзины: скидка %, кол-во позиций
+    SNAPSHOT_HEADER = struct.Struct('<dI')
+
     # пустая корзина
     def __init__(self):
 
@@ -246,28 +669,420 @@ class ShoppingCart:
             raise ValueError("Скидка должна быть в диапазоне от 0 до 50%")
         self.discount = percent
 
+    # строки содержимого корзины (генератор)
+    def iter_lines(self, show_details: bool = False):
+
+        yield "\n=========== ВАША КОРЗИНА =========="
+        for idx, item in enumerate(self.items, 1):
+            yield f"{idx}. {item}"
+            if show_details:
+                yield f"   Категория: {item.product.category}"
+                yield f"   Вес: {item.total_weight:.2f} кг"
+
+        yield "\nИтого:"
+        yield f"Количество позиций: {self.item_count}"
+        yield f"Общее количество товаров: {self.total_quantity}"
+        yield f"Общий вес: {self.total_weight:.2f} кг"
+        if self.discount > 0:
+            yield f"Скидка: {self.discount}%"
+        yield f"Общая стоимость: {self.total_price:.2f} руб."
+        yield "============================================="
+
     # вывод содержимого корзины
-    def display(self, show_details: bool = False):
+    @METRICS.timed('display_cart')
+    def display(self, show_details: bool = False, out=None):
 
         if not self.items:
-            print("Ваша корзина пуста.")
+            write_lines(["Ваша корзина пуста."], out)
             return
 
-        print("\n=========== ВАША КОРЗИНА ==========")
-        for idx, item in enumerate(self.items, 1):
-            print(f"{idx}. {item}")
-            if show_details:
-                print(f"   Категория: {item.product.category}")
-                print(f"   Вес: {item.total_weight:.2f} кг")
+        write_lines(self.iter_lines(show_details), out)
 
-        print("\nИтого:")
-        print(f"Количество позиций: {self.item_count}")
-        print(f"Общее количество товаров: {self.total_quantity}")
-        print(f"Общий вес: {self.total_weight:.2f} кг")
-        if self.discount > 0:
-            print(f"Скидка: {self.discount}%")
-        print(f"Общая стоимость: {self.total_price:.2f} руб.")
-        print("=============================================")
+    # снимок корзины: скидка, кол-во позиций и пары (ID товара, кол-во) без данных товаров
+    def to_snapshot(self) -> bytes:
+
+        pairs = []
+        for item in self.items:
+            pairs.append(item.product.id)
+            pairs.append(item.quantity)
+        return self.SNAPSHOT_HEADER.pack(self.discount, len(self.items)) + struct.pack(f'<{len(pairs)}q', *pairs)
+
+    # восстановление корзины из снимка; товары берутся из индекса каталога по ID,
+    # позиции с товарами, которых больше нет в каталоге, пропускаются
+    @staticmethod
+    def from_snapshot(data: bytes, index: Dict[int, Product]) -> 'ShoppingCart':
+
+        discount, count = ShoppingCart.SNAPSHOT_HEADER.unpack_from(data)
+        pairs = struct.unpack_from(f'<{count * 2}q', data, ShoppingCart.SNAPSHOT_HEADER.size)
+        cart = ShoppingCart()
+        cart.discount = discount
+        items = cart.items
+        for idx in range(0, len(pairs), 2):
+            product = index.get(pairs[idx])
+            if product is not None:
+                items.append(CartItem(product, pairs[idx + 1]))
+        return cart
+
+# класс хранилища сессий: пакетное сохранение и восстановление снимков корзин
+class CartSessionStore:
+
+    MAGIC = b'CRTS'
+    HEADER = struct.Struct('<4sI')      # сигнатура, кол-во сессий
+    ENTRY = struct.Struct('<HI')        # длина ключа сессии, длина снимка корзины
+
+    # сохранение корзин {ключ сессии: корзина} в файл
+    @staticmethod
+    def save_sessions(filename: str, sessions: Dict[str, ShoppingCart]) -> bool:
+
+        try:
+            chunks = [CartSessionStore.HEADER.pack(CartSessionStore.MAGIC, len(sessions))]
+            for session_id, cart in sessions.items():
+                key = session_id.encode('utf-8')
+                snapshot = cart.to_snapshot()
+                chunks.append(CartSessionStore.ENTRY.pack(len(key), len(snapshot)))
+                chunks.append(key)
+                chunks.append(snapshot)
+            with open(filename, 'wb') as f:
+                f.write(b''.join(chunks))
+            return True
+        except Exception as e:
+            print(f"Ошибка при сохранении корзин: {e}")
+            return False
+
+    # загрузка корзин из файла с привязкой позиций к товарам каталога по индексу ID
+    @staticmethod
+    def load_sessions(filename: str, catalog: ProductCatalog) -> Optional[Dict[str, ShoppingCart]]:
+
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            magic, count = CartSessionStore.HEADER.unpack_from(data)
+            if magic != CartSessionStore.MAGIC:
+                raise ValueError("файл не является файлом корзин")
+
+            index = catalog.index
+            entry = CartSessionStore.ENTRY
+            sessions = {}
+            pos = CartSessionStore.HEADER.size
+            for _ in range(count):
+                key_len, snapshot_len = entry.unpack_from(data, pos)
+                pos += entry.size
+                session_id = data[pos:pos + key_len].decode('utf-8')
+                pos += key_len
+                sessions[session_id] = ShoppingCart.from_snapshot(data[pos:pos + snapshot_len], index)
+                pos += snapshot_len
+            return sessions
+        except Exception as e:
+            print(f"Ошибка при загрузке корзин: {e}")
+            return None
+
+# класс истории заказов: журнал строк заказов на диске и агрегаты продаж
+class OrderHistory:
+
+    # строка заказа: ID заказа, время, ID товара, индекс категории, кол-во, цена за шт., скидка %
+    LINE = struct.Struct('<IdIIIdd')
+    DAY = 24 * 60 * 60
+
+    # файл журнала, сохранение агрегатов после каждого заказа,
+    # сколько дней хранить агрегаты по дням (более старые сворачиваются в архив)
+    def __init__(self, filename: str = "orders.log", autosave: bool = True, retention_days: int = 30):
+
+        if retention_days <= 0:
+            raise ValueError("Срок хранения должен быть положительным числом")
+        self.filename = filename
+        self.aggregates_file = filename + ".agg.json"
+        self.categories_file = filename + ".categories"     # таблица категорий, по строке на категорию
+        self.autosave = autosave
+        self.retention_days = retention_days
+        self.next_order_id = 1
+        self.categories = []            # индекс - название категории
+        self._category_index = {}       # название категории - индекс
+        self.days = {}                  # день - {'c': {категория: [кол-во, выручка]}, 'p': {ID товара: [...]}}
+        self.archive = {'c': {}, 'p': {}}   # агрегаты дней старше срока хранения
+        self.archived_before = None     # строки журнала за дни раньше этого учтены в архиве
+        self.totals = {'c': {}, 'p': {}}    # агрегаты за все время (архив + все дни)
+        self.log_size = 0               # длина журнала (байт), учтенная в агрегатах
+
+        if os.path.exists(self.categories_file):
+            with open(self.categories_file, 'r', encoding='utf-8') as f:
+                self.categories = f.read().splitlines()
+            self._category_index = {name: idx for idx, name in enumerate(self.categories)}
+
+        if os.path.exists(self.aggregates_file):
+            try:
+                self.load_aggregates()
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # агрегаты - производный файл, источник истины - журнал
+                print(f"Ошибка при загрузке агрегатов продаж ({e}), пересчет по журналу заказов")
+                self.next_order_id = 1
+                self.archive = {'c': {}, 'p': {}}
+                self.archived_before = None
+                self._repair_log()
+                self.rebuild_aggregates()
+                self.save_aggregates()
+        elif os.path.exists(self.filename):
+            self._repair_log()
+            self.rebuild_aggregates()
+
+    # отрезание оборванной записи в конце журнала (сбой посреди записи), иначе следующие строки сдвинутся
+    def _repair_log(self):
+
+        if not os.path.exists(self.filename):
+            return
+        size = os.path.getsize(self.filename)
+        if size % self.LINE.size:
+            os.truncate(self.filename, size - size % self.LINE.size)
+
+    # индекс категории (новые категории дописываются в конец таблицы)
+    def _category_id(self, category: str) -> int:
+
+        idx = self._category_index.get(category)
+        if idx is None:
+            idx = len(self.categories)
+            with open(self.categories_file, 'a', encoding='utf-8') as f:
+                f.write(category.replace('\n', ' ') + '\n')
+            self.categories.append(category)
+            self._category_index[category] = idx
+        return idx
+
+    # + строки заказа к агрегатам
+    @staticmethod
+    def _add_to(bucket: Dict, key: int, quantity: int, revenue: float):
+
+        counter = bucket.get(key)
+        if counter is None:
+            bucket[key] = [quantity, revenue]
+        else:
+            counter[0] += quantity
+            counter[1] += revenue
+
+    # учет строки заказа в агрегатах дня
+    def _account(self, timestamp: float, product_id: int, category_id: int, quantity: int,
+                 unit_price: float, discount: float):
+
+        day = int(timestamp // self.DAY)
+        if self.archived_before is not None and day < self.archived_before:
+            bucket = self.archive
+        else:
+            bucket = self.days.get(day)
+            if bucket is None:
+                bucket = self.days[day] = {'c': {}, 'p': {}}
+        revenue = unit_price * quantity * (1 - discount / 100)
+        self._add_to(bucket['c'], category_id, quantity, revenue)
+        self._add_to(bucket['p'], product_id, quantity, revenue)
+        self._add_to(self.totals['c'], category_id, quantity, revenue)
+        self._add_to(self.totals['p'], product_id, quantity, revenue)
+
+    # сворачивание дней раньше first_day в архив (размер агрегатов не растет с историей)
+    def _fold_days(self, first_day: int):
+
+        for day in [day for day in self.days if day < first_day]:
+            bucket = self.days.pop(day)
+            for part in ('c', 'p'):
+                for key, (quantity, revenue) in bucket[part].items():
+                    self._add_to(self.archive[part], key, quantity, revenue)
+        if self.archived_before is None or first_day > self.archived_before:
+            self.archived_before = first_day
+
+    # первый хранимый день при текущем сроке хранения
+    def _first_day(self, now: Optional[float] = None, retention_days: Optional[int] = None) -> int:
+
+        retention_days = self.retention_days if retention_days is None else retention_days
+        return int((time.time() if now is None else now) // self.DAY) - retention_days + 1
+
+    # пересчет агрегатов за все время из архива и дней
+    def _recount_totals(self):
+
+        self.totals = {'c': {}, 'p': {}}
+        for bucket in [self.archive] + list(self.days.values()):
+            for part in ('c', 'p'):
+                for key, (quantity, revenue) in bucket[part].items():
+                    self._add_to(self.totals[part], key, quantity, revenue)
+
+    # оформление заказа: строки корзины дописываются в журнал, возвращается ID заказа
+    @METRICS.timed('checkout')
+    def checkout(self, cart: ShoppingCart, timestamp: Optional[float] = None) -> int:
+
+        if not cart.items:
+            raise ValueError("Корзина пуста. Невозможно оформить заказ.")
+
+        timestamp = time.time() if timestamp is None else timestamp
+        order_id = self.next_order_id
+        lines = [(order_id, timestamp, item.product.id, self._category_id(item.product.category),
+                  item.quantity, item.product.price, cart.discount) for item in cart.items]
+        data = b''.join(self.LINE.pack(*line) for line in lines)
+
+        # агрегаты обновляются только после успешной записи в журнал
+        with open(self.filename, 'ab') as f:
+            f.write(data)
+        first_day = self._first_day()
+        if self.archived_before is None or first_day > self.archived_before:
+            self._fold_days(first_day)
+        for line in lines:
+            self._account(*line[1:])
+        self.log_size += len(data)
+        self.next_order_id += 1
+
+        if self.autosave:
+            self.save_aggregates()
+        return order_id
+
+    # чтение строк журнала блоками, начиная с байта start
+    def iter_lines(self, start: int = 0, block_lines: int = 65536):
+
+        if not os.path.exists(self.filename):
+            return
+        block = self.LINE.size * block_lines
+        with open(self.filename, 'rb') as f:
+            f.seek(start)
+            while True:
+                data = f.read(block)
+                if not data:
+                    break
+                usable = len(data) - len(data) % self.LINE.size     # оборванная запись в конце игнорируется
+                yield from self.LINE.iter_unpack(data[:usable])
+
+    # сохранение агрегатов в файл; compacting - уплотнение журнала еще не завершено
+    def save_aggregates(self, compacting: bool = False):
+
+        def dump(bucket):
+            return {'c': {str(k): v for k, v in bucket['c'].items()},
+                    'p': {str(k): v for k, v in bucket['p'].items()}}
+
+        data = {
+            'next_order_id': self.next_order_id,
+            'log_size': self.log_size,
+            'compacting': compacting,
+            'archived_before': self.archived_before,
+            'days': {str(day): dump(bucket) for day, bucket in self.days.items()},
+            'archive': dump(self.archive)
+        }
+        tmp_name = self.aggregates_file + ".tmp"
+        with open(tmp_name, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_name, self.aggregates_file)
+
+    # загрузка агрегатов из файла
+    def load_aggregates(self):
+
+        def parse(bucket):
+            return {'c': {int(k): v for k, v in bucket['c'].items()},
+                    'p': {int(k): v for k, v in bucket['p'].items()}}
+
+        with open(self.aggregates_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.next_order_id = data['next_order_id']
+        self.days = {int(day): parse(bucket) for day, bucket in data['days'].items()}
+        self.archive = parse(data['archive'])
+        self.archived_before = data.get('archived_before')
+        self._recount_totals()
+
+        # сбой посреди уплотнения: агрегаты уже сохранены, осталось подменить журнал уплотненным
+        if data.get('compacting'):
+            tmp_name = self.filename + ".tmp"
+            if os.path.exists(tmp_name):
+                os.replace(tmp_name, self.filename)
+
+        # журнал мог пополниться после сохранения агрегатов (сбой, autosave=False) - дочитываем хвост
+        self._repair_log()
+        log_size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+        stored = data.get('log_size')
+        if stored is None or stored > log_size:
+            self.rebuild_aggregates()
+        else:
+            self.log_size = stored
+            if stored < log_size:
+                self._replay(stored)
+
+        if data.get('compacting') or stored != self.log_size:
+            self.save_aggregates()
+
+    # учет строк журнала начиная с байта start; следующий ID заказа - после последнего в журнале
+    # skip_archived - пропускать строки, уже учтенные в архиве (при полном пересчете)
+    def _replay(self, start: int, skip_archived: bool = False):
+
+        cutoff = self.archived_before * self.DAY if skip_archived and self.archived_before is not None else None
+        max_order_id = 0
+        count = 0
+        for order_id, timestamp, product_id, category_id, quantity, unit_price, discount in self.iter_lines(start):
+            if cutoff is None or timestamp >= cutoff:
+                self._account(timestamp, product_id, category_id, quantity, unit_price, discount)
+            if order_id > max_order_id:
+                max_order_id = order_id
+            count += 1
+        self.log_size = start + count * self.LINE.size
+        self.next_order_id = max(self.next_order_id, max_order_id + 1)
+
+    # пересчет агрегатов дней по журналу (архив и таблица категорий сохраняются)
+    def rebuild_aggregates(self):
+
+        self.days = {}
+        self._recount_totals()
+        self._replay(0, skip_archived=True)
+
+    # дни, попадающие в окно последних N дней (не больше срока хранения)
+    def _window(self, days: Optional[int], now: Optional[float]) -> List[Dict]:
+
+        if days is None:
+            return [self.totals]
+        today = int((time.time() if now is None else now) // self.DAY)
+        return [self.days[day] for day in range(today - days + 1, today + 1) if day in self.days]
+
+    # выручка и кол-во по категориям за последние N дней (None - за все время)
+    def sales_by_category(self, days: Optional[int] = 7, now: Optional[float] = None) -> Dict[str, Tuple[int, float]]:
+
+        totals = {}
+        for bucket in self._window(days, now):
+            for category_id, (quantity, revenue) in bucket['c'].items():
+                self._add_to(totals, category_id, quantity, revenue)
+        return {self.categories[idx]: (quantity, revenue) for idx, (quantity, revenue) in totals.items()}
+
+    # самые продаваемые товары: (ID товара, кол-во, выручка), по кол-ву или выручке
+    def top_products(self, n: int = 10, days: Optional[int] = None, by: str = 'quantity',
+                     now: Optional[float] = None) -> List[Tuple[int, int, float]]:
+
+        if by not in ('quantity', 'revenue'):
+            raise ValueError("Недопустимый критерий. Допустимые значения: 'quantity', 'revenue'")
+        totals = {}
+        for bucket in self._window(days, now):
+            for product_id, (quantity, revenue) in bucket['p'].items():
+                self._add_to(totals, product_id, quantity, revenue)
+        field = 0 if by == 'quantity' else 1
+        best = heapq.nlargest(n, totals.items(), key=lambda pair: pair[1][field])
+        return [(product_id, quantity, revenue) for product_id, (quantity, revenue) in best]
+
+    # уплотнение: дни старше окна переносятся в архив агрегатов, строки архива удаляются из журнала
+    def compact(self, retention_days: Optional[int] = None, now: Optional[float] = None) -> int:
+
+        if retention_days is not None and retention_days <= 0:
+            raise ValueError("Срок хранения должен быть положительным числом")
+        self._fold_days(self._first_day(now, retention_days))
+
+        removed = 0
+        if os.path.exists(self.filename):
+            cutoff = self.archived_before * self.DAY
+            tmp_name = self.filename + ".tmp"
+            kept_count = 0
+            with open(tmp_name, 'wb') as out:
+                kept = []
+                for line in self.iter_lines():
+                    if line[1] < cutoff:
+                        removed += 1
+                        continue
+                    kept.append(self.LINE.pack(*line))
+                    kept_count += 1
+                    if len(kept) >= 65536:
+                        out.write(b''.join(kept))
+                        kept = []
+                out.write(b''.join(kept))
+
+            # агрегаты с пометкой сохраняются до подмены журнала: после сбоя подмена завершится при загрузке
+            self.log_size = kept_count * self.LINE.size
+            self.save_aggregates(compacting=True)
+            os.replace(tmp_name, self.filename)
+
+        self.save_aggregates()
+        return removed
 
 # класс выбора сортировки
 class SortStrategy(ABC):
@@ -429,7 +1244,349 @@ class CartSorter:
         if not strategy:
             raise ValueError(f"Неизвестная сортировки: {strategy_name}")
 
-        return strategy.sort(cart.items, key, reverse)
+        with METRICS.timer('sort_cart.' + strategy_name.lower()):
+            return strategy.sort(cart.items, key, reverse)
+
+# класс внешней сортировки (слиянием) каталога, не помещающегося в память
+class ExternalCatalogSorter:
+
+    READ_BUFFER = 1 << 16           # размер блока чтения исходного файла, символов
+    RUN_BUFFER = 1 << 16            # буфер чтения каждого временного прогона при слиянии, байт
+    MAX_RECORD_CHARS = 1 << 20      # предельный размер одной записи каталога, символов
+    MAX_MERGE_FANIN = 64            # предел одновременно открытых прогонов (далеко от лимита дескрипторов)
+
+    # лимит памяти на один блок товаров (байт), каталог для временных файлов
+    def __init__(self, memory_limit: int = 64 * 1024 * 1024, temp_dir: Optional[str] = None):
+
+        if memory_limit <= 0:
+            raise ValueError("Лимит памяти должен быть положительным числом")
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+        # прогонов на одно слияние: на каждый - буфер файла и примерно столько же на декодирование текста
+        self.merge_fanin = max(2, min(memory_limit // (2 * self.RUN_BUFFER), self.MAX_MERGE_FANIN))
+
+    # потоковое чтение товаров из файла формата catalog.json (JSON-массив) без загрузки целиком
+    def iter_catalog_file(self, filename: str):
+
+        decoder = json.JSONDecoder()
+        with open(filename, 'r', encoding='utf-8') as f:
+            buffer = ''
+            pos = 0
+            started = False
+            eof = False
+
+            while True:
+                # пропуск пробелов (и запятых между элементами после '[')
+                while pos < len(buffer) and buffer[pos] in (' \t\r\n,' if started else ' \t\r\n'):
+                    pos += 1
+
+                if pos >= len(buffer):
+                    if eof:
+                        if started:
+                            raise ValueError("Файл каталога оборван: нет закрывающей ']'")
+                        raise ValueError("Файл каталога должен содержать JSON-массив")
+                    chunk = f.read(self.READ_BUFFER)
+                    eof = not chunk
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                    continue
+
+                if not started:
+                    if buffer[pos] != '[':
+                        raise ValueError("Файл каталога должен содержать JSON-массив")
+                    started = True
+                    pos += 1
+                    continue
+
+                if buffer[pos] == ']':
+                    return
+
+                try:
+                    data, end = decoder.raw_decode(buffer, pos)
+                except ValueError as e:
+                    # объект не поместился в буфер - дочитываем, но не больше размера одной записи
+                    if eof or len(buffer) - pos > self.MAX_RECORD_CHARS:
+                        raise ValueError(f"Некорректная запись в файле каталога: {e}")
+                    chunk = f.read(self.READ_BUFFER)
+                    eof = not chunk
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                    continue
+
+                yield Product.from_dict(data)
+                pos = end
+
+    # оценка занимаемой товаром памяти
+    @staticmethod
+    def _estimate_size(item: CartItem) -> int:
+
+        product = item.product
+        size = sys.getsizeof(item) + sys.getsizeof(product) + sys.getsizeof(product.__dict__)
+        for value in product.__dict__.values():
+            size += sys.getsizeof(value)
+        return size
+
+    # запись отсортированных позиций во временный файл (JSON по строке на товар)
+    def _write_run(self, items) -> str:
+
+        fd, path = tempfile.mkstemp(prefix='catalog_run_', suffix='.jsonl', dir=self.temp_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8', buffering=self.RUN_BUFFER) as f:
+            for item in items:
+                f.write(json.dumps(item.product.to_dict(), ensure_ascii=False))
+                f.write('\n')
+        return path
+
+    # сортировка блока и запись его прогона
+    def _spill_run(self, chunk: List[CartItem], key_func, reverse: bool) -> str:
+
+        chunk.sort(key=key_func, reverse=reverse)
+        return self._write_run(chunk)
+
+    # чтение прогона обратно в виде позиций, чтобы применить те же функции ключа
+    def _read_run(self, path: str):
+
+        with open(path, 'r', encoding='utf-8', buffering=self.RUN_BUFFER) as f:
+            for line in f:
+                yield CartItem(Product.from_dict(json.loads(line)))
+
+    # внешняя сортировка: блоки в пределах лимита, прогоны во временных файлах, k-путевое слияние
+    def sort_file(self, input_file: str, output_file: str, key: str = 'price', reverse: bool = False) -> Dict:
+
+        key_func = SortStrategy.get_key_function(key)
+        start_time = time.time()
+        runs = []
+        created = []                    # все временные файлы, для удаления в конце
+        records = 0
+        passes = 0
+        initial_runs = 0
+
+        try:
+            chunk = []
+            chunk_size = 0
+            for product in self.iter_catalog_file(input_file):
+                item = CartItem(product)
+                chunk.append(item)
+                chunk_size += self._estimate_size(item)
+                records += 1
+                if chunk_size >= self.memory_limit:
+                    runs.append(self._spill_run(chunk, key_func, reverse))
+                    created.append(runs[-1])
+                    chunk = []
+                    chunk_size = 0
+            if chunk:
+                runs.append(self._spill_run(chunk, key_func, reverse))
+                created.append(runs[-1])
+                chunk = []
+            initial_runs = len(runs)
+
+            # промежуточные проходы: группы не более merge_fanin прогонов сливаются в новые прогоны
+            # (группы идут по порядку, поэтому слияние остается устойчивым)
+            while len(runs) > self.merge_fanin:
+                next_runs = []
+                for idx in range(0, len(runs), self.merge_fanin):
+                    group = runs[idx:idx + self.merge_fanin]
+                    if len(group) == 1:
+                        next_runs.append(group[0])
+                        continue
+                    merged = heapq.merge(*[self._read_run(path) for path in group], key=key_func, reverse=reverse)
+                    path = self._write_run(merged)
+                    created.append(path)
+                    next_runs.append(path)
+                    for old_path in group:
+                        os.remove(old_path)
+                runs = next_runs
+                passes += 1
+
+            # последнее слияние: heapq.merge устойчиво и держит в памяти по одному товару на прогон
+            merged = heapq.merge(*[self._read_run(path) for path in runs], key=key_func, reverse=reverse)
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write('[')
+                first = True
+                for item in merged:
+                    f.write('\n' if first else ',\n')
+                    text = json.dumps(item.product.to_dict(), ensure_ascii=False, indent=4)
+                    f.write('    ' + text.replace('\n', '\n    '))
+                    first = False
+                f.write('\n]' if not first else ']')
+        finally:
+            for path in created:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        elapsed = time.time() - start_time
+        return {
+            'records': records,
+            'runs': initial_runs,
+            'merge_passes': passes + (1 if runs else 0),
+            'seconds': elapsed,
+            'records_per_sec': records / elapsed if elapsed > 0 else 0.0
+        }
+
+# класс дифференциальной проверки сортировок: случайные корзины, сравнение с sorted(), сжатие ошибок
+class SortDifferentialTester:
+
+    KEYS = ('price', 'weight', 'category')
+    STABLE = ('bubble', 'insertion', 'merge')           # устойчивые сортировки
+    SIZES = (0, 1, 2, 3, 5, 10, 100, 1000, 3000, 10000, 100000)
+    # вперемешку кириллица, латиница, регистр, пробелы, цифры и пустая строка
+    CATEGORIES = ("Электроника", "электроника", "Книги", "Books", "books", "Одежда ", " Одежда", "",
+                  "Ёлки", "Ели", "Zeta", "zeta", "10", "9", "Бытовая техника")
+
+    # seed генератора, предельный размер корзины для квадратичных сортировок, лимит сжатия
+    def __init__(self, seed: int = 1, quadratic_limit: int = 3000, shrink_limit: int = 5000,
+                 max_shrink_checks: int = 300, shrink_seconds: float = 10.0):
+
+        self.rng = random.Random(seed)
+        self.sorter = CartSorter()
+        self.size_limits = {'bubble': quadratic_limit, 'insertion': quadratic_limit}
+        self.shrink_limit = shrink_limit
+        self.max_shrink_checks = max_shrink_checks
+        self.shrink_seconds = shrink_seconds    # бюджет времени на сжатие одного случая
+
+    # случайная корзина: ID уникальны, значения ключей с разной долей повторов
+    # (distinct - цена и вес почти без повторов)
+    def generate_cart(self, size: int, distinct: bool = False) -> List[CartItem]:
+
+        rng = self.rng
+        pool = None if distinct else rng.choice((1, 2, 5, 50, None))     # None - почти без повторов
+        price_pool = [round(rng.uniform(1, 100000), 2) for _ in range(pool or 0)]
+        weight_pool = [round(rng.uniform(0.01, 50), 3) for _ in range(pool or 0)]
+        categories = rng.sample(self.CATEGORIES, rng.randint(1, len(self.CATEGORIES)))
+
+        items = []
+        for idx in range(size):
+            price = rng.choice(price_pool) if pool else round(rng.uniform(1, 100000), 2)
+            weight = rng.choice(weight_pool) if pool else round(rng.uniform(0.01, 50), 3)
+            product = Product(idx + 1, "Товар %d" % (idx + 1), rng.choice(categories), price, weight)
+            items.append(CartItem(product, rng.randint(1, 10)))
+        return items
+
+    # сравнение одной сортировки с эталоном: (вид расхождения или None, время сортировки)
+    # 'error <тип исключения>' - исключение, 'lost' - потеряны/продублированы позиции, 'order' - неверный порядок,
+    # 'unstable' - порядок равных элементов отличается от исходного
+    def check(self, strategy_name: str, items: List[CartItem], key: str, reverse: bool) -> Tuple[Optional[str], float]:
+
+        key_func = SortStrategy.get_key_function(key)
+        start_time = time.perf_counter()
+        try:
+            result = self.sorter.strategies[strategy_name].sort(items, key, reverse)
+        except Exception as e:
+            return 'error ' + type(e).__name__, time.perf_counter() - start_time
+        elapsed = time.perf_counter() - start_time
+
+        expected = sorted(items, key=key_func, reverse=reverse)
+        result_ids = [item.product.id for item in result]
+        expected_ids = [item.product.id for item in expected]
+        if result_ids == expected_ids:
+            return None, elapsed
+        if sorted(result_ids) != sorted(expected_ids):
+            return 'lost', elapsed
+        if [key_func(item) for item in result] != [key_func(item) for item in expected]:
+            return 'order', elapsed
+        return 'unstable', elapsed
+
+    # сжатие упавшего случая (ddmin): удаляем куски, пока расхождение того же вида сохраняется
+    def shrink(self, strategy_name: str, items: List[CartItem], key: str, reverse: bool, kind: str) -> List[CartItem]:
+
+        checks = 0
+        deadline = time.perf_counter() + self.shrink_seconds
+        chunk = len(items) // 2
+        while chunk >= 1 and checks < self.max_shrink_checks:
+            start = 0
+            reduced = False
+            while start < len(items) and checks < self.max_shrink_checks and time.perf_counter() < deadline:
+                candidate = items[:start] + items[start + chunk:]
+                checks += 1
+                if self.check(strategy_name, candidate, key, reverse)[0] == kind:
+                    items = candidate
+                    reduced = True
+                else:
+                    start += chunk
+            if time.perf_counter() >= deadline:
+                break
+            if not reduced:
+                chunk //= 2
+        return items
+
+    # прогон: для каждого размера случайные корзины, все ключи, оба направления, все сортировки
+    def run(self, sizes=SIZES, cases_per_size: Optional[int] = None) -> Dict:
+
+        stats = {name: {'checks': 0, 'failures': [], 'stability_differences': 0,
+                        'skipped': 0, 'seconds': 0.0, 'seconds_by_size': {}, 'recursion_sizes': []}
+                 for name in self.sorter.strategies}
+        combos = [(key, reverse) for key in self.KEYS for reverse in (False, True)]
+
+        for size in sizes:
+            cases = cases_per_size or (20 if size <= 100 else 3 if size <= 10000 else 1)
+            for case_no in range(cases):
+                # первая большая корзина - с различными ценами и весами, чтобы быстрая сортировка
+                # проверялась на больших размерах, а не только падала на повторах
+                items = self.generate_cart(size, distinct=case_no == 0 and size > 1000)
+                for name, entry in stats.items():
+                    if size > self.size_limits.get(name, size):
+                        entry['skipped'] += len(combos)
+                        continue
+                    for done, (key, reverse) in enumerate(combos):
+                        key_func = SortStrategy.get_key_function(key)
+                        kind, elapsed = self.check(name, items, key, reverse)
+                        entry['checks'] += 1
+                        entry['seconds'] += elapsed
+                        entry['seconds_by_size'][size] = entry['seconds_by_size'].get(size, 0.0) + elapsed
+
+                        if kind == 'unstable' and name not in self.STABLE:
+                            entry['stability_differences'] += 1
+                        elif kind == 'error RecursionError' and entry['recursion_sizes']:
+                            # повторное переполнение рекурсии: без сжатия и отдельной ошибки в отчете,
+                            # остаток этой корзины пропускается, большие корзины проверяются дальше
+                            entry['recursion_sizes'].append(size)
+                            entry['skipped'] += len(combos) - done - 1
+                            break
+                        elif kind is not None:
+                            case = items
+                            shrunk = size <= self.shrink_limit
+                            if shrunk:
+                                case = self.shrink(name, items, key, reverse, kind)
+                            entry['failures'].append({
+                                'kind': kind, 'key': key, 'reverse': reverse, 'size': size, 'shrunk': shrunk,
+                                'case': [(item.product.id, key_func(item)) for item in case]
+                                if len(case) <= 20 else len(case)
+                            })
+                            if kind == 'error RecursionError':
+                                entry['recursion_sizes'].append(size)
+                                entry['skipped'] += len(combos) - done - 1
+                                break
+        return stats
+
+    # текстовый отчет по результатам run
+    @staticmethod
+    def report(stats: Dict) -> str:
+
+        lines = ["========== ПРОВЕРКА СОРТИРОВОК (эталон: sorted) =========="]
+        for name, entry in stats.items():
+            lines.append(f"{name}: проверок {entry['checks']}, ошибок {len(entry['failures'])}, "
+                         f"отличий устойчивости {entry['stability_differences']}, "
+                         f"пропущено {entry['skipped']}, время {entry['seconds']:.3f} сек.")
+            if len(entry['recursion_sizes']) > 1:
+                lines.append(f"   повторных RecursionError: {len(entry['recursion_sizes']) - 1} "
+                             f"(размеры корзин: {', '.join(str(size) for size in entry['recursion_sizes'][1:])}), "
+                             f"остаток таких корзин не проверялся")
+            for size, seconds in sorted(entry['seconds_by_size'].items()):
+                lines.append(f"   размер {size}: {seconds:.4f} сек.")
+            for failure in entry['failures']:
+                order = "по убыванию" if failure['reverse'] else "по возрастанию"
+                case = failure['case']
+                if isinstance(case, list):
+                    shown = f"сжато до {case}"
+                elif failure['shrunk']:
+                    shown = f"сжато до {case} позиций"
+                else:
+                    shown = "не сжато"
+                lines.append(f"   ОШИБКА {failure['kind']}: ключ {failure['key']}, {order}, "
+                             f"размер {failure['size']}, {shown}")
+        lines.append("==========================================================")
+        return "\n".join(lines)
 
 # класс меню магазина
 class ShopUI:
@@ -439,6 +1596,9 @@ class ShopUI:
         self.catalog = ProductCatalog()
         self.cart = ShoppingCart()
         self.sorter = CartSorter()
+        self.history = OrderHistory("orders.log")
+        self.page_size = 20             # товаров на странице каталога
+        METRICS.enable()
         self.setup_sample_data()
 
     # начальные продукты данных
@@ -468,6 +1628,12 @@ class ShopUI:
         print("10. Добавить новый товар в каталог")
         print("11. Редактировать товар в каталоге")
         print("12. Удалить товар из каталога")
+        print("13. Экспорт каталога из файла с внешней сортировкой")
+        print("14. Оформить заказ")
+        print("15. Аналитика продаж")
+        print("16. Метрики производительности")
+        print("17. Сохранить корзину в файл")
+        print("18. Загрузить корзину из файла")
         print(" 0. Выход")
 
     # запуск основного цикла меню
@@ -502,6 +1668,18 @@ class ShopUI:
                     self.edit_product_in_catalog()
                 elif choice == '12':
                     self.remove_product_from_catalog()
+                elif choice == '13':
+                    self.export_sorted_catalog()
+                elif choice == '14':
+                    self.checkout()
+                elif choice == '15':
+                    self.show_sales_analytics()
+                elif choice == '16':
+                    self.show_metrics()
+                elif choice == '17':
+                    self.save_cart()
+                elif choice == '18':
+                    self.load_cart()
                 elif choice == '0':
                     print("\nСпасибо за посещение нашего Интернет-магазина! Ждем вас в гости!")
                     break
@@ -512,26 +1690,45 @@ class ShopUI:
 
     # вывод каталога товаров
     def show_catalog(self, detailed: bool = False):
-        self.catalog.display_catalog()
+        category = input("Категория для фильтра (Enter - все товары): ") or None
+
+        offset = 0
+        while self.catalog.display_catalog(self.page_size, offset, category):
+            if input("Enter - следующая страница, 0 - завершить просмотр: ") != '':
+                break
+            offset += self.page_size
 
         if detailed:
             product_id = input("Введите ID товара для просмотра деталей (или 0 для возврата): ")
             if product_id != '0':
-                product = self.catalog.find_product_by_id(int(product_id))
+                with METRICS.timer('find_product_by_id'):
+                    product = self.catalog.find_product_by_id(int(product_id))
                 if product:
                     print("\n" + str(product))
                 else:
                     print("Товар не найден.")
 
+    # постраничный выбор товара: возвращает введенный ID (строкой)
+    def choose_product_id(self, prompt: str) -> str:
+        offset = 0
+        while True:
+            has_more = self.catalog.display_catalog(self.page_size, offset)
+            if not has_more:
+                return input(f"{prompt} (или 0 для отмены): ")
+
+            answer = input(f"{prompt} (Enter - следующая страница, 0 - отмена): ")
+            if answer != '':
+                return answer
+            offset += self.page_size
+
     # функция + товара в корзину
     def add_to_cart(self):
-        self.show_catalog()
-
-        product_id = input("Введите ID товара для добавления в корзину (или 0 для отмены): ")
+        product_id = self.choose_product_id("Введите ID товара для добавления в корзину")
         if product_id == '0':
             return
 
-        product = self.catalog.find_product_by_id(int(product_id))
+        with METRICS.timer('find_product_by_id'):
+            product = self.catalog.find_product_by_id(int(product_id))
         if not product:
             print("Товар не найден.")
             return
@@ -542,7 +1739,8 @@ class ShopUI:
                 print("Количество должно быть положительным числом.")
                 return
 
-            self.cart.add_item(product, quantity)
+            with METRICS.timer('add_item'):
+                self.cart.add_item(product, quantity)
             print(f"Товар '{product.name}' добавлен в корзину.")
         except ValueError:
             print("Неверный формат количества.")
@@ -570,12 +1768,14 @@ class ShopUI:
                         if quantity <= 0 or quantity > item.quantity:
                             print("Неверное количество.")
                             return
-                        self.cart.remove_item(item.product.id, quantity)
+                        with METRICS.timer('remove_item'):
+                            self.cart.remove_item(item.product.id, quantity)
                         print(f"Удалено {quantity} шт. товара '{item.product.name}'.")
                     except ValueError:
                         print("Неверный формат количества.")
                 else:
-                    self.cart.remove_item(item.product.id)
+                    with METRICS.timer('remove_item'):
+                        self.cart.remove_item(item.product.id)
                     print(f"Товар '{item.product.name}' полностью удален из корзины.")
             else:
                 print("Неверный номер позиции.")
@@ -704,7 +1904,7 @@ class ShopUI:
         filename = input("Введите имя файла для загрузки (по умолчанию: catalog.json): ") or "catalog.json"
         if self.catalog.load_from_file(filename):
             print(f"Каталог успешно загружен из файла {filename}")
-            self.catalog.display_catalog()
+            self.catalog.display_catalog(self.page_size)
         else:
             print("Не удалось загрузить каталог.")
 
@@ -735,20 +1935,20 @@ class ShopUI:
 
             description = input("Описание товара (необязательно): ")
 
-            product = self.catalog.add_product(name, category, price, weight, description)
+            with METRICS.timer('add_product'):
+                product = self.catalog.add_product(name, category, price, weight, description)
             print(f"\nТовар успешно добавлен в каталог (сохранить каталог в файл в основном меню):\n{product}")
         except ValueError:
             print("Ошибка ввода данных. Пожалуйста, введите корректные значения.")
 
     # функция редактирование товара в каталоге
     def edit_product_in_catalog(self):
-        self.show_catalog()
-
-        product_id = input("Введите ID товара для редактирования (или 0 для отмены): ")
+        product_id = self.choose_product_id("Введите ID товара для редактирования")
         if product_id == '0':
             return
 
-        product = self.catalog.find_product_by_id(int(product_id))
+        with METRICS.timer('find_product_by_id'):
+            product = self.catalog.find_product_by_id(int(product_id))
         if not product:
             print("Товар не найден.")
             return
@@ -784,7 +1984,8 @@ class ShopUI:
                 print("Ничего не изменено.")
                 return
 
-            updated_product = self.catalog.edit_product(product.id, **updates)
+            with METRICS.timer('edit_product'):
+                updated_product = self.catalog.edit_product(product.id, **updates)
             if updated_product:
                 print("\nТовар успешно обновлен (сохранить каталог в файл в основном меню):")
                 print(updated_product)
@@ -795,28 +1996,297 @@ class ShopUI:
 
     # функция - товара из каталога
     def remove_product_from_catalog(self):
-        self.show_catalog()
-
-        product_id = input("Введите ID товара для удаления (или 0 для отмены): ")
+        product_id = self.choose_product_id("Введите ID товара для удаления")
         if product_id == '0':
             return
 
         try:
             product_id = int(product_id)
-            product = self.catalog.find_product_by_id(product_id)
+            with METRICS.timer('find_product_by_id'):
+                product = self.catalog.find_product_by_id(product_id)
             if not product:
                 print("Товар не найден.")
                 return
 
             confirm = input(f"Вы уверены, что хотите удалить товар '{product.name}'? (д/н): ").lower()
             if confirm == 'д':
-                if self.catalog.remove_product(product_id):
+                with METRICS.timer('remove_product'):
+                    removed = self.catalog.remove_product(product_id)
+                if removed:
                     print("Товар успешно удален из каталога.")
                 else:
                     print("Не удалось удалить товар.")
         except ValueError:
             print("Неверный формат ID.")
 
+    # функция экспорт большого каталога из файла в отсортированный файл
+    def export_sorted_catalog(self):
+        input_file = input("Исходный файл каталога (по умолчанию: catalog.json): ") or "catalog.json"
+        output_file = input("Файл для результата (по умолчанию: catalog_sorted.json): ") or "catalog_sorted.json"
+        if os.path.abspath(input_file) == os.path.abspath(output_file):
+            print("Файл результата должен отличаться от исходного.")
+            return
+
+        print("\nКритерии сортировки:")
+        print("1. По цене")
+        print("2. По весу")
+        print("3. По категории")
+
+        criteria = {
+            '1': 'price',
+            '2': 'weight',
+            '3': 'category'
+        }
+
+        criterion = input("Выберите критерий сортировки (1-3): ")
+        if criterion not in criteria:
+            print("Неверный выбор критерия.")
+            return
+
+        order = input("Сортировать по возрастанию (1) или убыванию (2)? ")
+        reverse = order == '2'
+
+        try:
+            memory_mb = float(input("Лимит памяти, МБ (по умолчанию: 64): ") or "64")
+            sorter = ExternalCatalogSorter(int(memory_mb * 1024 * 1024))
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+
+        try:
+            stats = sorter.sort_file(input_file, output_file, criteria[criterion], reverse)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ошибка при экспорте каталога: {e}")
+            return
+
+        print(f"Экспортировано товаров: {stats['records']} в файл {output_file}")
+        print(f"Временных прогонов: {stats['runs']}")
+        print(f"Время: {stats['seconds']:.3f} сек. ({stats['records_per_sec']:.0f} записей/сек.)")
+
+    # функция оформление заказа
+    def checkout(self):
+        if not self.cart.items:
+            print("Корзина пуста. Невозможно оформить заказ.")
+            return
+
+        self.cart.display()
+        confirm = input("Оформить заказ? (д/н): ").lower()
+        if confirm != 'д':
+            return
+
+        order_id = self.history.checkout(self.cart)
+        self.cart.clear()
+        print(f"Заказ №{order_id} оформлен. Корзина очищена.")
+
+    # функция вывод аналитики продаж
+    def show_sales_analytics(self):
+        days = input("За сколько последних дней (по умолчанию: 7, 0 - за все время): ") or "7"
+        try:
+            days = int(days) or None
+        except ValueError:
+            print("Неверный формат числа дней.")
+            return
+
+        sales = self.history.sales_by_category(days)
+        if not sales:
+            print("Продаж за выбранный период нет.")
+            return
+
+        print("\n========== ВЫРУЧКА ПО КАТЕГОРИЯМ ==========")
+        for category, (quantity, revenue) in sorted(sales.items(), key=lambda pair: -pair[1][1]):
+            print(f"{category}: {quantity} шт., {revenue:.2f} руб.")
+
+        print("\n========== ТОП ПРОДАВАЕМЫХ ТОВАРОВ ==========")
+        for place, (product_id, quantity, revenue) in enumerate(self.history.top_products(10, days), 1):
+            product = self.catalog.find_product_by_id(product_id)
+            name = product.name if product else f"ID {product_id}"
+            print(f"{place}. {name}: {quantity} шт., {revenue:.2f} руб.")
+        print("=============================================")
+
+    # функция вывод метрик, профилирование и экспорт
+    def show_metrics(self):
+        print("\n" + METRICS.report())
+
+        print("\n1. Включить профилирование")
+        print("2. Выключить профилирование")
+        print("3. Отчет профилировщика")
+        print("4. Экспорт метрик в формате Prometheus")
+        print("5. Сбросить метрики")
+        action = input("Выберите действие (Enter - назад): ")
+
+        if action == '1':
+            try:
+                rate = float(input("Доля профилируемых операций, % (по умолчанию: 100): ") or "100")
+                METRICS.enable_profiling(rate / 100)
+                print("Профилирование включено.")
+            except ValueError as e:
+                print(f"Ошибка: {e}")
+        elif action == '2':
+            METRICS.disable_profiling()
+            print("Профилирование выключено.")
+        elif action == '3':
+            print(METRICS.profile_report())
+        elif action == '4':
+            filename = input("Введите имя файла (по умолчанию: metrics.prom): ") or "metrics.prom"
+            if METRICS.export_prometheus(filename):
+                print(f"Метрики сохранены в файл {filename}")
+        elif action == '5':
+            METRICS.reset()
+            print("Метрики сброшены.")
+
+    # функция сохранение корзины в файл
+    def save_cart(self):
+        filename = input("Введите имя файла для сохранения (по умолчанию: cart.bin): ") or "cart.bin"
+        if CartSessionStore.save_sessions(filename, {'default': self.cart}):
+            print(f"Корзина успешно сохранена в файл {filename}")
+        else:
+            print("Не удалось сохранить корзину.")
+
+    # функция загрузка корзины из файла
+    def load_cart(self):
+        if self.cart.items:
+            confirm = input("Текущая корзина будет заменена. Продолжить? (д/н): ").lower()
+            if confirm != 'д':
+                return
+
+        filename = input("Введите имя файла для загрузки (по умолчанию: cart.bin): ") or "cart.bin"
+        sessions = CartSessionStore.load_sessions(filename, self.catalog)
+        if not sessions or 'default' not in sessions:
+            print("Не удалось загрузить корзину.")
+            return
+
+        self.cart = sessions['default']
+        print(f"Корзина успешно загружена из файла {filename}")
+        self.cart.display()
+
+# бенчмарк снимков корзин: компактный формат против JSON с полными товарами
+def benchmark_cart_snapshots(sessions_count: int = 10000, lines_per_cart: int = 20, seed: int = 1) -> Dict:
+
+    rng = random.Random(seed)
+    catalog = ProductCatalog()
+    for idx in range(5000):
+        catalog.add_product("Товар %d" % idx, "Категория %d" % (idx % 20), rng.uniform(10, 10000),
+                            rng.uniform(0.1, 20), "Описание товара %d" % idx)
+
+    sessions = {}
+    for idx in range(sessions_count):
+        cart = ShoppingCart()
+        for product in rng.sample(catalog.products, lines_per_cart):
+            cart.add_item(product, rng.randint(1, 5))
+        cart.discount = rng.choice((0, 5, 10, 15))
+        sessions["session-%d" % idx] = cart
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_file = os.path.join(tmp_dir, "carts.bin")
+        json_file = os.path.join(tmp_dir, "carts.json")
+
+        start_time = time.time()
+        CartSessionStore.save_sessions(snapshot_file, sessions)
+        snapshot_save = time.time() - start_time
+        start_time = time.time()
+        restored = CartSessionStore.load_sessions(snapshot_file, catalog)
+        snapshot_load = time.time() - start_time
+        if restored is None or len(restored) != sessions_count:
+            raise RuntimeError("Снимки корзин не восстановились")
+
+        start_time = time.time()
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump({session_id: {'discount': cart.discount,
+                                    'items': [{'product': item.product.to_dict(), 'quantity': item.quantity}
+                                              for item in cart.items]}
+                       for session_id, cart in sessions.items()}, f, ensure_ascii=False)
+        json_save = time.time() - start_time
+        start_time = time.time()
+        with open(json_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for session_id, entry in data.items():
+            cart = ShoppingCart()
+            cart.discount = entry['discount']
+            cart.items = [CartItem(Product.from_dict(item['product']), item['quantity']) for item in entry['items']]
+        json_load = time.time() - start_time
+
+        snapshot_size = os.path.getsize(snapshot_file)
+        json_size = os.path.getsize(json_file)
+
+    return {
+        'sessions': sessions_count,
+        'snapshot_bytes': snapshot_size,
+        'json_bytes': json_size,
+        'snapshot_save_per_sec': sessions_count / snapshot_save if snapshot_save > 0 else 0.0,
+        'snapshot_load_per_sec': sessions_count / snapshot_load if snapshot_load > 0 else 0.0,
+        'json_save_per_sec': sessions_count / json_save if json_save > 0 else 0.0,
+        'json_load_per_sec': sessions_count / json_load if json_load > 0 else 0.0
+    }
+
+# бенчмарк истории заказов: запись миллионов строк, запросы по агрегатам, уплотнение
+def benchmark_order_history(total_lines: int = 2_000_000, lines_per_order: int = 10, seed: int = 1) -> Dict:
+
+    rng = random.Random(seed)
+    categories = ["Категория %d" % idx for idx in range(20)]
+    products = [Product(idx, "Товар %d" % idx, rng.choice(categories), rng.uniform(10, 10000), 1.0)
+                for idx in range(1, 5001)]
+    start_ts = time.time() - 60 * OrderHistory.DAY
+    orders = total_lines // lines_per_order
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        history = OrderHistory(os.path.join(tmp_dir, "orders.log"), autosave=False)
+        cart = ShoppingCart()
+
+        start_time = time.time()
+        for order in range(orders):
+            cart.items = [CartItem(product, rng.randint(1, 5)) for product in rng.sample(products, lines_per_order)]
+            cart.discount = rng.choice((0, 0, 5, 10))
+            history.checkout(cart, start_ts + order * (60 * OrderHistory.DAY / orders))
+        history.save_aggregates()
+        write_seconds = time.time() - start_time
+        log_size = os.path.getsize(history.filename)
+
+        start_time = time.time()
+        history.sales_by_category(7)
+        history.top_products(10)
+        query_seconds = time.time() - start_time
+
+        start_time = time.time()
+        scanned = {}
+        for line in history.iter_lines():
+            category = history.categories[line[3]]
+            scanned[category] = scanned.get(category, 0.0) + line[5] * line[4] * (1 - line[6] / 100)
+        scan_seconds = time.time() - start_time
+
+        start_time = time.time()
+        removed = history.compact(retention_days=7)
+        compact_seconds = time.time() - start_time
+
+    lines = orders * lines_per_order
+    return {
+        'lines': lines,
+        'bytes_per_line': log_size / lines if lines else 0,
+        'write_lines_per_sec': lines / write_seconds if write_seconds > 0 else 0.0,
+        'aggregate_query_seconds': query_seconds,
+        'raw_scan_seconds': scan_seconds,
+        'compact_seconds': compact_seconds,
+        'compacted_lines': removed
+    }
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench-orders':
+        stats = benchmark_order_history(int(sys.argv[2]) if len(sys.argv) > 2 else 2_000_000)
+        for name, value in stats.items():
+            print(f"{name}: {value:.6g}" if isinstance(value, float) else f"{name}: {value}")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench-carts':
+        stats = benchmark_cart_snapshots(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+        for name, value in stats.items():
+            print(f"{name}: {value:.6g}" if isinstance(value, float) else f"{name}: {value}")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'validate-sorts':
+        max_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        tester = SortDifferentialTester(int(sys.argv[3]) if len(sys.argv) > 3 else 1)
+        stats = tester.run([size for size in SortDifferentialTester.SIZES if size <= max_size])
+        print(SortDifferentialTester.report(stats))
+        sys.exit(1 if any(entry['failures'] for entry in stats.values()) else 0)
+
     ui = ShopUI()
     ui.run()